@@ -1,21 +1,45 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import asyncio
+import json
+import logging
 import time
 
-# Import your existing model and new RAG system
+# Import the LLM and RAG system
 from app.models.generated import model
 from app.services.rag import get_rag_system, RAGSystem
+from app.services.embeddings import EMBEDDING_MODEL
+from app.services.qdrant import get_health_client
+from app.services.preview import make_preview
+from app.logging_config import setup_logging, shutdown_logging
+
+log = logging.getLogger("hikma")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background services with the app"""
+    setup_logging()
+    # Build and warm up this worker's RAG system off the event loop
+    await asyncio.to_thread(lambda: get_rag().warmup())
+    yield
+    shutdown_logging()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Saudi Labor Law Chatbot with RAG", 
     description="AI-powered chatbot for Saudi Labor Law queries using Retrieval-Augmented Generation",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Initialize RAG system (do this once at startup)
-rag_system = get_rag_system()
+@lru_cache(maxsize=1)
+def get_rag() -> RAGSystem:
+    """RAG system for this worker process (created on first use, then reused)"""
+    return get_rag_system()
 
 # Pydantic models for request/response
 class QuestionRequest(BaseModel):
@@ -50,89 +74,179 @@ def root():
         ],
         "endpoints": {
             "/ask": "POST - Ask questions about Saudi Labor Law",
+            "/ask/stream": "POST - Ask a question and stream the answer (Server-Sent Events)",
+            "/ask_batch": "POST - Ask several questions in one request",
             "/search": "POST - Search for relevant law sections",
             "/health": "GET - Health check"
         }
     }
 
+# Last Qdrant health probe as (checked_at, error or None), reused for a few seconds
+HEALTH_CACHE_TTL = 5.0
+_health_status = (0.0, None)
+
 @app.get("/health")
-def health_check():
+async def health_check():
     """Health check endpoint"""
-    try:
-        # Test RAG system connectivity
-        test_result = rag_system.retrieve_context("test", )
-        return {
-            "status": "healthy",
-            "rag_system": "operational",
-            "collection": rag_system.collection_name,
-            "timestamp": time.time()
-        }
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Service unhealthy: {str(e)}")
+    global _health_status
+    rag_system = get_rag()
+    
+    checked_at, error = _health_status
+    now = time.time()
+    if now - checked_at > HEALTH_CACHE_TTL:
+        try:
+            # Test Qdrant connectivity without running an embedding + search;
+            # the health client's own timeout bounds the call
+            await asyncio.to_thread(get_health_client().get_collection, rag_system.collection_name)
+            error = None
+        except Exception as e:
+            error = str(e)
+        _health_status = (now, error)
+    
+    if error is not None:
+        raise HTTPException(status_code=503, detail=f"Service unhealthy: {error}")
+    
+    return {
+        "status": "healthy",
+        "rag_system": "operational",
+        "collection": rag_system.collection_name,
+        "timestamp": now
+    }
+
+def _extract_answer(llm_response) -> str:
+    """Extract answer content (adjust based on your model's response format)"""
+    if hasattr(llm_response, 'content'):
+        if isinstance(llm_response.content, list):
+            return llm_response.content[0] if llm_response.content else "No response generated"
+        return llm_response.content
+    return str(llm_response)
+
+def _build_chat_response(request: QuestionRequest, context_chunks: List[Dict[str, Any]],
+                         llm_response, processing_time: float) -> ChatResponse:
+    """Build the /ask response for one question"""
+    # Prepare context chunks for response (if requested)
+    response_chunks = None
+    if request.include_context:
+        response_chunks = [
+            ContextChunk(
+                # Points stored before previews were added fall back to slicing
+                text=chunk.get("preview") or make_preview(chunk["text"]),
+                source_file=chunk["source_file"],
+                page=chunk["page"],
+                score=chunk["score"],
+                chunk_id=chunk["chunk_id"]
+            )
+            for chunk in context_chunks
+        ]
+    
+    return ChatResponse(
+        question=request.question,
+        answer=_extract_answer(llm_response),
+        processing_time=round(processing_time, 3),
+        context_used=len(context_chunks) > 0,
+        context_chunks=response_chunks,
+        num_context_chunks=len(context_chunks)
+    )
 
 @app.post("/ask", response_model=ChatResponse)
-def ask_question(request: QuestionRequest):
+async def ask_question(request: QuestionRequest):
     """
     Ask a question about Saudi Labor Law with RAG-enhanced responses
     """
     start_time = time.time()
+    rag_system = get_rag()
     
     try:
-        # Get RAG-augmented response
-        rag_response = rag_system.get_augmented_response(request.question)
-        rag_response["top_k"] = request.max_context_chunks
-        print('***'*20 )
-        print(f"RAG retrieved {len(rag_response['context_chunks'])} chunks for question.")
-        # Generate answer using LLM with context
-        llm_response = model.invoke(rag_response["rag_prompt"])
-        print("LLM Response:", llm_response)
-        # Extract answer content (adjust based on your model's response format)
-        if hasattr(llm_response, 'content'):
-            if isinstance(llm_response.content, list):
-                answer = llm_response.content[0] if llm_response.content else "No response generated"
-            else:
-                answer = llm_response.content
-        else:
-            answer = str(llm_response)
+        # Get the RAG prompt (the formatted-context response dict isn't needed here)
+        rag_prompt, context_chunks = await asyncio.to_thread(rag_system.get_prompt_only, request.question)
+        log.info("RAG retrieved %d chunks for question.", len(context_chunks))
+        # Generate answer using LLM with context (vLLM batches concurrent requests)
+        llm_response = await model.ainvoke(rag_prompt)
+        log.debug("LLM Response: %s", llm_response)
         
         # Calculate processing time
         processing_time = time.time() - start_time
         
-        # Prepare context chunks for response (if requested)
-        context_chunks = None
-        if request.include_context:
-            context_chunks = [
-                ContextChunk(
-                    text=chunk["text"][:500] + "..." if len(chunk["text"]) > 500 else chunk["text"],
-                    source_file=chunk["source_file"],
-                    page=chunk["page"],
-                    score=chunk["score"],
-                    chunk_id=chunk["chunk_id"]
-                )
-                for chunk in rag_response["context_chunks"]
-            ]
+        return _build_chat_response(request, context_chunks, llm_response, processing_time)
         
-        return ChatResponse(
-            question=request.question,
-            answer=answer,
-            processing_time=round(processing_time, 3),
-            context_used=len(rag_response["context_chunks"]) > 0,
-            context_chunks=context_chunks,
-            num_context_chunks=len(rag_response["context_chunks"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    """
+    Ask a question and stream the answer tokens as Server-Sent Events
+    """
+    rag_system = get_rag()
+    try:
+        rag_prompt, context_chunks = await asyncio.to_thread(rag_system.get_prompt_only, request.question)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
+    
+    async def event_stream():
+        # vLLM batches concurrent streams like any other requests
+        try:
+            async for chunk in model.astream(rag_prompt):
+                if chunk.content:
+                    yield f"data: {json.dumps({'token': chunk.content})}\n\n"
+        except Exception as e:
+            log.error("Error streaming answer: %s", e)
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'num_context_chunks': len(context_chunks)})}\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+# Most questions accepted by one /ask_batch request
+MAX_BATCH_QUESTIONS = 32
+
+@app.post("/ask_batch", response_model=List[ChatResponse])
+async def ask_question_batch(requests: List[QuestionRequest]):
+    """
+    Ask several questions at once; retrieval and generation are batched
+    """
+    if len(requests) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch, got {len(requests)}"
         )
+    
+    start_time = time.time()
+    rag_system = get_rag()
+    
+    try:
+        questions = [request.question for request in requests]
+        
+        # One batched embedding + one Qdrant round trip for all questions
+        batch_chunks = await asyncio.to_thread(rag_system.retrieve_context_batch, questions)
+        prompts = [
+            rag_system.generate_rag_prompt(question, rag_system.format_context_for_llm(context_chunks))
+            for question, context_chunks in zip(questions, batch_chunks)
+        ]
+        
+        # Sent concurrently; vLLM's continuous batching schedules them together
+        llm_responses = await model.abatch(prompts)
+        
+        processing_time = time.time() - start_time
+        
+        return [
+            _build_chat_response(request, context_chunks, llm_response, processing_time)
+            for request, context_chunks, llm_response in zip(requests, batch_chunks, llm_responses)
+        ]
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing questions: {str(e)}")
 
 @app.post("/search")
-def search_context(request: QuestionRequest) -> Dict[str, Any]:
+async def search_context(request: QuestionRequest) -> Dict[str, Any]:
     """
     Search for relevant context without generating an answer
     Useful for finding specific law sections
     """
+    rag_system = get_rag()
     try:
         # Get only the context
-        context_chunks = rag_system.retrieve_context(request.question)
+        context_chunks = await asyncio.to_thread(rag_system.retrieve_context, request.question)
         
         return {
             "query": request.question,
@@ -153,17 +267,18 @@ def search_context(request: QuestionRequest) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=f"Error searching context: {str(e)}")
 
 @app.post("/ask-simple")
-def ask_question_simple(question: str):
+async def ask_question_simple(question: str):
     """
     Simple endpoint for basic questions (backward compatibility)
     Uses RAG but returns simpler response format
     """
+    rag_system = get_rag()
     try:
-        # Get RAG response
-        rag_response = rag_system.get_augmented_response(question)
+        # Get RAG prompt
+        rag_prompt, context_chunks = await asyncio.to_thread(rag_system.get_prompt_only, question)
         
         # Generate answer
-        answer = model.invoke(rag_response["rag_prompt"])
+        answer = await model.ainvoke(rag_prompt)
         
         # Extract content
         if hasattr(answer, 'content'):
@@ -174,7 +289,7 @@ def ask_question_simple(question: str):
         return {
             "question": question, 
             "answer": content,
-            "context_sources": len(rag_response["context_chunks"])
+            "context_sources": len(context_chunks)
         }
         
     except Exception as e:
@@ -182,11 +297,12 @@ def ask_question_simple(question: str):
 
 # Additional utility endpoints
 @app.get("/stats")
-def get_system_stats():
+async def get_system_stats():
     """Get system statistics"""
+    rag_system = get_rag()
     try:
         client = rag_system.client
-        collection_info = client.get_collection(rag_system.collection_name)
+        collection_info = await asyncio.to_thread(client.get_collection, rag_system.collection_name)
         
         return {
             "collection_name": rag_system.collection_name,
@@ -195,12 +311,22 @@ def get_system_stats():
             "distance_metric": collection_info.config.params.vectors.distance,
             "rag_settings": {
                 "default_top_k": rag_system.top_k,
-                "embedding_model": "sentence-transformers/all-MiniLM-L6-v2"
+                "embedding_model": EMBEDDING_MODEL
             }
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=7500)
\ No newline at end of file
+    # Workers need an import string; each worker builds its own RAG system
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=7500,
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="uvloop",
+        http="httptools",
+        log_level="info"
+    )
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+Logging setup for the Saudi Labor Law Chatbot backend
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+
+LOGGER_NAME = "hikma"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+_listener = None
+
+def setup_logging(level: str = LOG_LEVEL):
+    """
+    Send `hikma.*` log records through a queue to a background listener
+
+    Request handlers only enqueue records; the listener thread does the
+    (blocking) stdout writes, so logging never stalls the event loop.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    _listener.start()
+
+def shutdown_logging():
+    """Flush queued log records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -20,4 +20,4 @@ app.add_middleware(
 
 
 
-# Run with: uvicorn app.main:app --reload --port 8000
+# Run with: uvicorn app.main:app --host 0.0.0.0 --port 7500 --workers 4 --loop uvloop --http httptools
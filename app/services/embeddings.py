@@ -1,15 +1,63 @@
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from fastembed import TextEmbedding
+from fastembed.common.model_description import ModelSource, PoolingType
+from functools import lru_cache
+from typing import List
+import numpy as np
 import os
 
-def get_embeddings():
-    """Initialize and return HuggingFace embeddings model"""
-    return HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={"device": "cpu"},
-        # Note: HuggingFaceEmbeddings doesn't need API token for sentence-transformers models
+# int8 (dynamically quantized) ONNX export of all-MiniLM-L6-v2, registered with
+# FastEmbed below; its built-in MiniLM entry is the fp32 export
+EMBEDDING_MODEL = "hikma/all-MiniLM-L6-v2-int8"
+_EMBEDDING_SOURCE = "Xenova/all-MiniLM-L6-v2"
+_EMBEDDING_FILE = "onnx/model_quantized.onnx"
+
+# ONNX Runtime intra-op threads; set to 1 when running one uvicorn worker per core
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0)) or None
+
+@lru_cache(maxsize=1)
+def _register_quantized_model():
+    """Register the int8 MiniLM export with FastEmbed (once per process)"""
+    # Same pooling and normalization as the sentence-transformers model
+    TextEmbedding.add_custom_model(
+        model=EMBEDDING_MODEL,
+        pooling=PoolingType.MEAN,
+        normalization=True,
+        sources=ModelSource(hf=_EMBEDDING_SOURCE),
+        dim=384,
+        model_file=_EMBEDDING_FILE
     )
 
+class FastEmbedEmbeddings:
+    """
+    ONNX Runtime (FastEmbed) embeddings with the langchain embed_query/embed_documents interface
+
+    Vectors are returned as float32 numpy arrays rather than lists of Python
+    floats; qdrant-client accepts them directly for queries and uploads.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, threads: int = EMBEDDING_THREADS):
+        # ONNX Runtime only, no torch needed
+        if model_name == EMBEDDING_MODEL:
+            _register_quantized_model()
+        self.model_name = model_name
+        self._model = TextEmbedding(model_name, providers=["CPUExecutionProvider"], threads=threads)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single query string, shape (dim,)"""
+        return np.asarray(next(iter(self._model.embed([text]))), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of document strings, shape (len(texts), dim)"""
+        if not texts:
+            return np.empty((0, get_embedding_dimension()), dtype=np.float32)
+        return np.stack(list(self._model.embed(texts))).astype(np.float32, copy=False)
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """Initialize (once per process) and return the embeddings model"""
+    return FastEmbedEmbeddings()
+
 def get_embedding_dimension():
     """Get the dimension of the embedding model"""
     # all-MiniLM-L6-v2 produces 384-dimensional embeddings
-    return 384
\ No newline at end of file
+    return 384
@@ -1,44 +1,99 @@
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from transformers import AutoTokenizer
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+import logging
+import multiprocessing
 import os
 import glob
 
-def load_pdf_to_chunks(pdf_path, chunk_size=500, chunk_overlap=50):
-    """Load a single PDF and split into chunks"""
-    # Load PDF
-    loader = PyPDFLoader(pdf_path)
-    documents = loader.load()
-    
-    # Split into smaller chunks
-    splitter = RecursiveCharacterTextSplitter(
+log = logging.getLogger("hikma.pdf_loader")
+
+# Chunk lengths are measured in tokens of the embedding model's tokenizer
+TOKENIZER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_TOKENS = 254  # MiniLM's 256-token window minus [CLS]/[SEP]
+CHUNK_OVERLAP_TOKENS = 32
+
+@lru_cache(maxsize=None)
+def get_splitter(chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS):
+    """Tokenizer-aware splitter (built once per process)"""
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_MODEL)
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         separators=["\n\n", "\n", " ", ""]
     )
-    docs = splitter.split_documents(documents)
+
+def load_pdf_to_chunks(pdf_path, chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS):
+    """Load a single PDF and split into chunks"""
+    # Load PDF
+    loader = PyPDFLoader(pdf_path)
+    documents = loader.load()
+
+    # Split into smaller chunks that fit the embedding model's window
+    docs = get_splitter(chunk_size, chunk_overlap).split_documents(documents)
+
+    # Add metadata about source file
+    for doc in docs:
+        doc.metadata['source_file'] = os.path.basename(pdf_path)
     return docs
 
-def load_all_pdfs_from_directory(pdf_directory, chunk_size=500, chunk_overlap=50):
+def load_all_pdfs_from_directory(pdf_directory, chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS):
     """Load all PDFs from a directory and split into chunks"""
     all_docs = []
-    
+
     # Find all PDF files in the directory
     pdf_files = glob.glob(os.path.join(pdf_directory, "*.pdf"))
-    
+
     if not pdf_files:
-        print(f"No PDF files found in {pdf_directory}")
+        log.warning("No PDF files found in %s", pdf_directory)
         return all_docs
-    
+
     for pdf_file in pdf_files:
-        print(f"Loading PDF: {pdf_file}")
+        log.info("Loading PDF: %s", pdf_file)
         docs = load_pdf_to_chunks(pdf_file, chunk_size, chunk_overlap)
-        
-        # Add metadata about source file
-        for doc in docs:
-            doc.metadata['source_file'] = os.path.basename(pdf_file)
-        
         all_docs.extend(docs)
-        print(f"Loaded {len(docs)} chunks from {pdf_file}")
-    
-    print(f"Total chunks loaded: {len(all_docs)}")
-    return all_docs
\ No newline at end of file
+        log.info("Loaded %d chunks from %s", len(docs), pdf_file)
+
+    log.info("Total chunks loaded: %d", len(all_docs))
+    return all_docs
+
+def iter_pdf_chunks(pdf_directory, chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS, max_workers=None):
+    """Parse the PDFs of a directory in parallel processes, yielding each file's chunks in file name order"""
+    pdf_files = sorted(glob.glob(os.path.join(pdf_directory, "*.pdf")))
+
+    if not pdf_files:
+        log.warning("No PDF files found in %s", pdf_directory)
+        return
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(pdf_files))
+    # Spawned, not forked: the caller may already run threads, gRPC channels
+    # and ONNX sessions, which don't survive a fork
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        def submit(pdf_file):
+            return pdf_file, executor.submit(load_pdf_to_chunks, pdf_file, chunk_size, chunk_overlap)
+
+        # At most max_workers files queued behind the one being consumed; the next
+        # file is submitted as each result is taken, so only a few parsed files
+        # are ever held in memory rather than the whole corpus
+        remaining = iter(pdf_files)
+        in_flight = deque(submit(pdf_file) for pdf_file in islice(remaining, max_workers))
+        while in_flight:
+            # Results are consumed in submission order (file name order)
+            pdf_file, future = in_flight.popleft()
+            next_file = next(remaining, None)
+            if next_file is not None:
+                in_flight.append(submit(next_file))
+            try:
+                docs = future.result()
+            except Exception as e:
+                log.error("Error loading PDF %s: %s", pdf_file, e)
+                continue
+            finally:
+                del future  # Don't keep the finished future (and its result) alive
+            log.info("Loaded %d chunks from %s", len(docs), pdf_file)
+            yield docs
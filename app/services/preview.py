@@ -0,0 +1,9 @@
+"""
+Chunk previews, shared by ingestion and the API (no heavy imports)
+"""
+
+PREVIEW_LENGTH = 500
+
+def make_preview(text, length=PREVIEW_LENGTH):
+    """Short preview of a chunk, as returned by the API"""
+    return text[:length] + "..." if len(text) > length else text
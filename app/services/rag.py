@@ -2,68 +2,324 @@
 RAG (Retrieval-Augmented Generation) system for Saudi Labor Law Chatbot
 """
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Optional
+from cachetools import LRUCache, TTLCache
+from qdrant_client.models import (
+    SearchParams, QuantizationSearchParams, QueryRequest, Filter, FieldCondition, MatchText
+)
+import hashlib
+import logging
+import numpy as np
+import re
+import threading
 # from embeddings import get_embeddings
 # from qdrant import get_client, COLLECTION_NAME
 
 from app.services.embeddings import get_embeddings
 from app.services.qdrant import get_client, COLLECTION_NAME
-from app.services.pdf_loader import load_pdf_to_chunks
+from app.services.reranker import get_reranker, RERANK_CANDIDATES
+
+log = logging.getLogger("hikma.rag")
+
+# Prompt pieces, built once at import instead of per request
+_PROMPT_HEADER = """You are an expert assistant specializing in Saudi Labor Law. You have access to relevant sections of the Saudi Labor Law documents to answer questions accurately.
+
+INSTRUCTIONS:
+1. Answer the question based primarily on the provided context from Saudi Labor Law documents
+2. If the context doesn't contain enough information, clearly state this
+3. Be specific and cite relevant articles, sections, or provisions when possible
+4. Provide practical, actionable advice when appropriate
+5. If you're unsure about any legal interpretation, recommend consulting with a legal professional
+6. Answer in a clear, professional manner suitable for someone seeking legal guidance
+
+"""
+_PROMPT_QUESTION = "\n\nQUESTION: "
+_PROMPT_FOOTER = "\n\nANSWER: Based on the Saudi Labor Law documents provided above, "
+
+_NO_CONTEXT = "No relevant information found in the Saudi Labor Law documents."
+_CONTEXT_HEADER = "=== RELEVANT SAUDI LABOR LAW INFORMATION ===\n"
+_CONTEXT_FOOTER = "=== END CONTEXT ==="
+_CTX_FMT = "Context {i}: [Source: {src}, Page: {pg}, Relevance: {score:.3f}]\n{text}\n---".format
+
+# Questions that start with an explicit article reference ("Article 74", "Mada 33").
+# "Mada" is the transliterated Arabic for article; the documents are in English.
+_ARTICLE_QUERY = re.compile(r'^\s*(?:article|mada)\s+(\d+)\b', re.IGNORECASE)
+# Text index matches scanned per article lookup (the number alone matches
+# many chunks, so fetch well past top_k before filtering on the phrase)
+_ARTICLE_SCAN_LIMIT = 256
+
+# Query embeddings keyed by normalized query, shared by single and batched retrieval
+_query_embeddings = LRUCache(maxsize=4096)
+_query_embeddings_lock = threading.Lock()
+_query_embeddings_stats = {"hits": 0, "misses": 0}
+
+def _embed_queries(queries: List[str]) -> List[np.ndarray]:
+    """Embed normalized queries, reusing cached vectors and embedding the rest in one batch"""
+    with _query_embeddings_lock:
+        embeddings = [_query_embeddings.get(query) for query in queries]
+    missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+    
+    new_embeddings = {}
+    if missing:
+        for query, embedding in zip(missing, get_embeddings().embed_documents(missing)):
+            embedding.setflags(write=False)  # Shared between callers via the cache
+            new_embeddings[query] = embedding
+    
+    with _query_embeddings_lock:
+        _query_embeddings.update(new_embeddings)
+        _query_embeddings_stats["hits"] += len(queries) - len(missing)
+        _query_embeddings_stats["misses"] += len(missing)
+    return [embedding if embedding is not None else new_embeddings[query]
+            for query, embedding in zip(queries, embeddings)]
+
+def _embed_query(query: str) -> np.ndarray:
+    """Embed a normalized query, reusing the result for repeated questions"""
+    return _embed_queries([query])[0]
+
+def _embed_cache_info() -> Dict[str, int]:
+    """Hit/miss counts and size of the query embedding cache"""
+    with _query_embeddings_lock:
+        return {**_query_embeddings_stats, "size": len(_query_embeddings), "maxsize": _query_embeddings.maxsize}
+
+def _split_article_chunks(context_chunks: List[Dict[str, Any]], article: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Split chunks into those defining "Article <n>" and those only citing it
+    
+    A chunk defines the article when one of its lines starts with the heading;
+    chunks without the phrase at all (the text index matches tokens anywhere) are dropped.
+    Base scores (1.0 defining, 0.5 citing) are replaced by reranker scores when reranking is enabled.
+    """
+    phrase = re.compile(rf'\barticle\s+{article}\b', re.IGNORECASE)
+    heading = re.compile(rf'^\s*article\s+{article}\b', re.IGNORECASE | re.MULTILINE)
+    defining, citing = [], []
+    for chunk in context_chunks:
+        if heading.search(chunk["text"]):
+            defining.append({**chunk, "score": 1.0})
+        elif phrase.search(chunk["text"]):
+            citing.append({**chunk, "score": 0.5})
+    return defining, citing
 
 class RAGSystem:
-    def __init__(self, collection_name: str = COLLECTION_NAME, top_k: int = 5):
+    def __init__(self, collection_name: str = COLLECTION_NAME, top_k: int = 5, num_candidates: int = RERANK_CANDIDATES,
+                 hnsw_ef: int = 128, use_reranker: bool = True):
         """
         Initialize RAG system
         
         Args:
             collection_name: Name of Qdrant collection
             top_k: Number of top similar chunks to retrieve
+            num_candidates: Number of vector search candidates passed to the reranker
+                (only top_k are fetched when reranking is disabled)
+            hnsw_ef: HNSW search beam width (higher = better recall, slower search)
+            use_reranker: Rerank vector search candidates (when a reranker is configured);
+                if False, results keep their vector search order and scores
         """
         self.collection_name = collection_name
         self.top_k = top_k
         self.client = get_client()
         self.embeddings = get_embeddings()
+        self.reranker = get_reranker() if use_reranker else None
+        self.num_candidates = max(num_candidates, top_k) if self.reranker is not None else top_k
+        self.hnsw_ef = max(hnsw_ef, self.num_candidates)
         
-    def retrieve_context(self, query: str) -> List[Dict[str, Any]]:
+        # Reranker scores keyed by (query, candidate chunk ids), kept for 15 minutes
+        self._rerank_cache = TTLCache(maxsize=1024, ttl=900)
+        self._rerank_lock = threading.Lock()
+        
+        # Prompts and context keyed by sha1(query), kept for 15 minutes
+        self._response_cache = TTLCache(maxsize=2048, ttl=900)
+        self._response_lock = threading.Lock()
+        
+    def warmup(self):
+        """Run one embedding, one rerank and one Qdrant call so the first request doesn't pay for loading"""
+        try:
+            self.embeddings.embed_query("warmup")
+            if self.reranker is not None:
+                list(self.reranker.rerank("warmup", ["warmup"]))
+            self.client.get_collection(self.collection_name)
+        except Exception as e:
+            # Qdrant may still be starting; requests will retry the connection
+            log.warning("RAG warmup incomplete: %s", e)
+    
+    def _search_params(self) -> SearchParams:
+        """Search parameters shared by single and batched retrieval"""
+        return SearchParams(
+            hnsw_ef=self.hnsw_ef,
+            quantization=QuantizationSearchParams(ignore=False, rescore=True, oversampling=2.0)
+        )
+    
+    def _format_results(self, search_results) -> List[Dict[str, Any]]:
+        """Convert Qdrant points into context chunk dictionaries"""
+        context_chunks = []
+        for result in search_results:
+            chunk = {
+                "text": result.payload.get("text", ""),
+                "preview": result.payload.get("preview"),  # Precomputed at ingest
+                "source_file": result.payload.get("source_file", "unknown"),
+                "page": result.payload.get("page", 0),
+                "score": getattr(result, "score", 1.0),  # Exact lookups have no score
+                "chunk_id": result.payload.get("chunk_id", result.id)
+            }
+            context_chunks.append(chunk)
+        return context_chunks
+    
+    def retrieve_context(self, query: str, search_params: Optional[SearchParams] = None) -> List[Dict[str, Any]]:
         """
         Retrieve relevant context for a given query
         
         Args:
             query: User's question
+            search_params: Qdrant search parameters overriding the defaults
+                (quantized search with rescoring, hnsw_ef from the constructor)
             
         Returns:
             List of relevant document chunks with metadata
         """
+        # Exact article references are served from the text index, no embedding/ANN
+        article_chunks = self._lookup_article(query)
+        if article_chunks:
+            return article_chunks
+        
         try:
-            # Generate embedding for the query
-            query_embedding = self.embeddings.embed_query(query)
+            # Generate embedding for the query (MiniLM is uncased, so
+            # normalizing case/whitespace doesn't change the vector)
+            query_embedding = _embed_query(query.strip().lower())
             
-            # Search in Qdrant
-            search_results = self.client.search(
+            # Fetch a wider candidate set from Qdrant for reranking
+            search_results = self.client.query_points(
                 collection_name=self.collection_name,
-                query_vector=query_embedding,
-                limit=self.top_k,
+                query=query_embedding,
+                limit=self.num_candidates,
                 with_payload=True,
-                with_vectors=False  # We don't need vectors in response
-            )
+                with_vectors=False,  # We don't need vectors in response
+                search_params=search_params or self._search_params()
+            ).points
             
             # Format results
-            context_chunks = []
-            for result in search_results:
-                chunk = {
-                    "text": result.payload.get("text", ""),
-                    "source_file": result.payload.get("source_file", "unknown"),
-                    "page": result.payload.get("page", 0),
-                    "score": result.score,
-                    "chunk_id": result.payload.get("chunk_id", result.id)
-                }
-                context_chunks.append(chunk)
+            context_chunks = self._format_results(search_results)
             
-            return context_chunks
+            return self.rerank(query, context_chunks)
             
         except Exception as e:
-            print(f"Error retrieving context: {e}")
+            log.error("Error retrieving context: %s", e)
+            return []
+    
+    def _lookup_article(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Find chunks containing an article referenced at the start of the query
+        
+        Args:
+            query: User's question
+            
+        Returns:
+            Matching chunks, those starting with the article heading first, or an
+            empty list if the query isn't an article reference or no scanned chunk
+            defines the article (the caller then falls back to vector search)
+        """
+        match = _ARTICLE_QUERY.match(query)
+        if not match:
             return []
+        
+        article = match.group(1)
+        try:
+            # The text index matches tokens anywhere in the chunk, so over-fetch
+            # and keep chunks where "Article <n>" actually appears as a phrase
+            records, _ = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=Filter(must=[
+                    FieldCondition(key="text", match=MatchText(text=f"article {article}"))
+                ]),
+                limit=_ARTICLE_SCAN_LIMIT,
+                with_payload=True,
+                with_vectors=False
+            )
+        except Exception as e:
+            log.error("Error looking up article %s: %s", article, e)
+            return []
+        
+        defining, citing = _split_article_chunks(self._format_results(records), article)
+        if not defining:
+            # Only citations were found (short article numbers match many chunks,
+            # so the defining one may be past the scan limit): use vector search
+            return []
+        
+        # Scroll returns storage order: rank each group, and keep chunks that
+        # define the article above chunks that only cite it
+        return (self.rerank(query, defining) + self.rerank(query, citing))[:self.top_k]
+    
+    def retrieve_context_batch(self, queries: List[str]) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve relevant context for several queries in one round trip
+        
+        Args:
+            queries: User questions
+            
+        Returns:
+            One list of relevant document chunks per query, in input order
+        """
+        if not queries:
+            return []
+        
+        try:
+            # Embed all uncached queries in a single batched call
+            query_embeddings = _embed_queries([query.strip().lower() for query in queries])
+            
+            # One Qdrant request for all searches
+            batch_results = self.client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[
+                    QueryRequest(
+                        query=embedding.tolist(),  # Request models need plain lists
+                        limit=self.num_candidates,
+                        params=self._search_params(),
+                        with_payload=True,
+                        with_vector=False
+                    )
+                    for embedding in query_embeddings
+                ]
+            )
+            
+            return [
+                self.rerank(query, self._format_results(response.points))
+                for query, response in zip(queries, batch_results)
+            ]
+            
+        except Exception as e:
+            log.error("Error retrieving batch context: %s", e)
+            return [[] for _ in queries]
+    
+    def rerank(self, query: str, context_chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Rerank candidate chunks with the cross-encoder and keep the top_k
+        
+        Args:
+            query: User's question
+            context_chunks: Candidate chunks from vector search
+            
+        Returns:
+            Top chunks ordered by reranker score (stored in "score"); the
+            vector search order if reranking is disabled or fails
+        """
+        if not context_chunks or self.reranker is None:
+            return context_chunks[:self.top_k]
+        
+        cache_key = (query, tuple(chunk["chunk_id"] for chunk in context_chunks))
+        with self._rerank_lock:
+            scores = self._rerank_cache.get(cache_key)
+        
+        if scores is None:
+            documents = [chunk["text"] for chunk in context_chunks]
+            try:
+                scores = [float(score) for score in self.reranker.rerank(query, documents)]
+            except Exception as e:
+                # Still answer from the vector search candidates
+                log.warning("Reranking failed, using vector search order: %s", e)
+                return context_chunks[:self.top_k]
+            with self._rerank_lock:
+                self._rerank_cache[cache_key] = scores
+        
+        ranked = sorted(zip(scores, context_chunks), key=lambda item: item[0], reverse=True)
+        return [{**chunk, "score": score} for score, chunk in ranked[:self.top_k]]
     
     def format_context_for_llm(self, context_chunks: List[Dict[str, Any]]) -> str:
         """
@@ -76,20 +332,16 @@ class RAGSystem:
             Formatted context string
         """
         if not context_chunks:
-            return "No relevant information found in the Saudi Labor Law documents."
-        
-        context_parts = []
-        context_parts.append("=== RELEVANT SAUDI LABOR LAW INFORMATION ===\n")
-        
-        for i, chunk in enumerate(context_chunks, 1):
-            source_info = f"[Source: {chunk['source_file']}, Page: {chunk['page']}, Relevance: {chunk['score']:.3f}]"
-            context_parts.append(f"Context {i}: {source_info}")
-            context_parts.append(chunk['text'])
-            context_parts.append("---")
-        
-        context_parts.append("=== END CONTEXT ===")
+            return _NO_CONTEXT
         
-        return "\n".join(context_parts)
+        return "\n".join([
+            _CONTEXT_HEADER,
+            *(
+                _CTX_FMT(i=i, src=chunk['source_file'], pg=chunk['page'], score=chunk['score'], text=chunk['text'])
+                for i, chunk in enumerate(context_chunks, 1)
+            ),
+            _CONTEXT_FOOTER
+        ])
     
     def generate_rag_prompt(self, query: str, context: str) -> str:
         """
@@ -102,23 +354,46 @@ class RAGSystem:
         Returns:
             Complete prompt for LLM
         """
-        prompt = f"""You are an expert assistant specializing in Saudi Labor Law. You have access to relevant sections of the Saudi Labor Law documents to answer questions accurately.
-
-INSTRUCTIONS:
-1. Answer the question based primarily on the provided context from Saudi Labor Law documents
-2. If the context doesn't contain enough information, clearly state this
-3. Be specific and cite relevant articles, sections, or provisions when possible
-4. Provide practical, actionable advice when appropriate
-5. If you're unsure about any legal interpretation, recommend consulting with a legal professional
-6. Answer in a clear, professional manner suitable for someone seeking legal guidance
-
-{context}
-
-QUESTION: {query}
-
-ANSWER: Based on the Saudi Labor Law documents provided above, """
-
-        return prompt
+        return "".join((_PROMPT_HEADER, context, _PROMPT_QUESTION, query, _PROMPT_FOOTER))
+    
+    def _build_prompt(self, query: str) -> Tuple[str, List[Dict[str, Any]], str]:
+        """Retrieve context and build the prompt, cached per query"""
+        cache_key = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        with self._response_lock:
+            cached = self._response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Step 1: Retrieve relevant context
+        context_chunks = self.retrieve_context(query)
+        
+        # Step 2: Format context for LLM
+        formatted_context = self.format_context_for_llm(context_chunks)
+        
+        # Step 3: Generate complete prompt
+        rag_prompt = self.generate_rag_prompt(query, formatted_context)
+        
+        result = (rag_prompt, context_chunks, formatted_context)
+        
+        # Don't cache failed/empty retrievals so they are retried next time
+        if context_chunks:
+            with self._response_lock:
+                self._response_cache[cache_key] = result
+        
+        return result
+    
+    def get_prompt_only(self, query: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Get just the LLM prompt and the chunks it was built from
+        
+        Args:
+            query: User's question
+            
+        Returns:
+            Tuple of (complete prompt for LLM, context chunks)
+        """
+        rag_prompt, context_chunks, _ = self._build_prompt(query)
+        return rag_prompt, context_chunks
     
     def get_augmented_response(self, query: str) -> Dict[str, Any]:
         """
@@ -130,25 +405,15 @@ ANSWER: Based on the Saudi Labor Law documents provided above, """
         Returns:
             Dictionary with answer, context, and metadata
         """
-        # Step 1: Retrieve relevant context
-        context_chunks = self.retrieve_context(query)
+        rag_prompt, context_chunks, formatted_context = self._build_prompt(query)
         
-        # Step 2: Format context for LLM
-        formatted_context = self.format_context_for_llm(context_chunks)
-        
-        # Step 3: Generate complete prompt
-        rag_prompt = self.generate_rag_prompt(query, formatted_context)
-        
-        # Step 4: Prepare response data
-        response_data = {
+        return {
             "query": query,
             "rag_prompt": rag_prompt,
             "context_chunks": context_chunks,
             "num_context_chunks": len(context_chunks),
             "formatted_context": formatted_context
         }
-        
-        return response_data
 
 # Utility functions for easy integration
 def get_rag_system() -> RAGSystem:
@@ -0,0 +1,19 @@
+from fastembed.rerank.cross_encoder import TextCrossEncoder
+from functools import lru_cache
+import os
+
+from app.services.embeddings import EMBEDDING_THREADS
+
+# A small cross-encoder keeps a rerank of RERANK_CANDIDATES pairs in the tens of
+# milliseconds on CPU; set RERANKER_MODEL="" to serve vector search order as-is
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "Xenova/ms-marco-MiniLM-L-6-v2")
+# Vector search candidates passed to the reranker
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 20))
+
+@lru_cache(maxsize=1)
+def get_reranker():
+    """Initialize (once per process) and return the cross-encoder reranker, or None if disabled"""
+    if not RERANKER_MODEL:
+        return None
+    # FastEmbed runs the ONNX export on ONNX Runtime, so torch is never imported
+    return TextCrossEncoder(RERANKER_MODEL, providers=["CPUExecutionProvider"], threads=EMBEDDING_THREADS)
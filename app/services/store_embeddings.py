@@ -1,107 +1,165 @@
 #!/usr/bin/env python3
 """
 Script to load PDFs, generate embeddings, and store them in Qdrant
+
+PDF parsing runs in worker processes, embedding runs in the main thread and
+upserts run in a background thread, so the three stages overlap. Memory is
+bounded by the pipeline, not the corpus: a few parsed files in the worker
+pool, up to 1024 chunks waiting for embedding and 4 embedded batches
+waiting for upload.
 """
 
 import os
 import sys
-from qdrant_client.models import PointStruct
-from pdf_loader import load_all_pdfs_from_directory, load_pdf_to_chunks
+import logging
+import queue
+import threading
+from pdf_loader import iter_pdf_chunks
+from preview import make_preview
 from embeddings import get_embeddings, get_embedding_dimension
 from qdrant import get_client, create_collection, COLLECTION_NAME
 
-def store_pdf_embeddings(pdf_directory="pdfs", collection_name=COLLECTION_NAME):
+log = logging.getLogger("hikma.ingest")
+
+_DONE = object()  # End-of-stream marker for the pipeline queues
+
+def _produce_docs(pdf_directory, doc_queue):
+    """Feed parsed chunks from the PDF worker processes into the queue"""
+    try:
+        for docs in iter_pdf_chunks(pdf_directory):
+            for doc in docs:
+                doc_queue.put(doc)
+    finally:
+        doc_queue.put(_DONE)
+
+def _upsert_points(client, collection_name, point_queue):
+    """Store batches of (ids, vectors, payloads) in Qdrant as they arrive"""
+    # Hold back one batch so the last upload can wait for everything to be applied
+    pending = None
+    while True:
+        batch = point_queue.get()
+        if pending is not None:
+            ids, vectors, payloads = pending
+            try:
+                # Takes the float32 matrix as-is, no per-point PointStruct lists
+                client.upload_collection(
+                    collection_name=collection_name,
+                    vectors=vectors,
+                    payload=payloads,
+                    ids=ids,
+                    batch_size=len(ids),
+                    wait=batch is _DONE
+                )
+                log.info("Successfully stored %d points", len(ids))
+            except Exception as e:
+                log.error("Error storing batch: %s", e)
+        if batch is _DONE:
+            return
+        pending = batch
+
+def store_pdf_embeddings(pdf_directory="pdfs", collection_name=COLLECTION_NAME, batch_size=256):
     """Main function to process PDFs and store embeddings"""
-    
-    print("=== Starting PDF Embedding Process ===")
-    
+
+    log.info("=== Starting PDF Embedding Process ===")
+
     # Check if PDF directory exists
     if not os.path.exists(pdf_directory):
-        print(f"Error: PDF directory '{pdf_directory}' not found!")
-        return False
-    
-    # Step 1: Load PDFs and split into chunks
-    print(f"\n1. Loading PDFs from '{pdf_directory}' directory...")
-    docs = load_all_pdfs_from_directory(pdf_directory, chunk_size=500, chunk_overlap=50)
-    
-    if not docs:
-        print("No documents loaded. Exiting.")
+        log.error("Error: PDF directory '%s' not found!", pdf_directory)
         return False
-    
-    # Step 2: Initialize embedding model
-    print("\n2. Initializing embedding model...")
+
+    # Step 1: Initialize embedding model
+    log.info("1. Initializing embedding model...")
     embed_model = get_embeddings()
     vector_size = get_embedding_dimension()
-    print(f"Using embedding model with dimension: {vector_size}")
-    
-    # Step 3: Create Qdrant collection
-    print("\n3. Setting up Qdrant collection...")
-    create_collection(collection_name, vector_size)
+    log.info("Using embedding model with dimension: %d", vector_size)
+
+    # Step 2: Create Qdrant collection (from scratch, so no points of a
+    # previous ingest survive above the new point count)
+    log.info("2. Setting up Qdrant collection...")
+    create_collection(collection_name, vector_size, recreate=True)
     client = get_client()
-    
-    # Step 4: Generate embeddings and store in batches
-    print("\n4. Generating embeddings and storing to Qdrant...")
-    batch_size = 100  # Process documents in batches to avoid memory issues
-    
-    for i in range(0, len(docs), batch_size):
-        batch_docs = docs[i:i + batch_size]
-        batch_end = min(i + batch_size, len(docs))
-        
-        print(f"Processing batch {i//batch_size + 1}: documents {i+1}-{batch_end}")
-        
+
+    # Step 3: Parse PDFs, generate embeddings and store them concurrently
+    log.info("3. Loading PDFs from '%s', generating embeddings and storing to Qdrant...", pdf_directory)
+    doc_queue = queue.Queue(maxsize=1024)
+    point_queue = queue.Queue(maxsize=4)
+
+    producer = threading.Thread(target=_produce_docs, args=(pdf_directory, doc_queue), daemon=True)
+    uploader = threading.Thread(target=_upsert_points, args=(client, collection_name, point_queue), daemon=True)
+    producer.start()
+    uploader.start()
+
+    total_docs = 0
+    done = False
+    while not done:
+        # Collect the next batch of chunks
+        batch_docs = []
+        while len(batch_docs) < batch_size:
+            doc = doc_queue.get()
+            if doc is _DONE:
+                done = True
+                break
+            batch_docs.append(doc)
+
+        if not batch_docs:
+            continue
+
+        log.info("Processing batch: documents %d-%d", total_docs + 1, total_docs + len(batch_docs))
+
         # Generate embeddings for this batch
         texts = [doc.page_content for doc in batch_docs]
         try:
             embeddings = embed_model.embed_documents(texts)
         except Exception as e:
-            print(f"Error generating embeddings: {e}")
+            log.error("Error generating embeddings: %s", e)
+            total_docs += len(batch_docs)
             continue
-        
+
         # Prepare points for Qdrant
-        points = []
-        for idx, (doc, embedding) in enumerate(zip(batch_docs, embeddings)):
-            point_id = i + idx  # Global ID across all batches
-            payload = {
+        # Global ID across all batches; chunks arrive in file order, so the
+        # same PDFs always get the same ids
+        ids = list(range(total_docs, total_docs + len(batch_docs)))
+        payloads = [
+            {
                 "text": doc.page_content,
+                "preview": make_preview(doc.page_content),
                 "source_file": doc.metadata.get('source_file', 'unknown'),
                 "page": doc.metadata.get('page', 0),
                 "chunk_id": point_id
             }
-            
-            points.append(PointStruct(
-                id=point_id,
-                vector=embedding,
-                payload=payload
-            ))
-        
-        # Store batch in Qdrant
-        try:
-            client.upsert(
-                collection_name=collection_name,
-                points=points
-            )
-            print(f"Successfully stored batch {i//batch_size + 1} ({len(points)} points)")
-        except Exception as e:
-            print(f"Error storing batch: {e}")
-            continue
-    
-    print(f"\n=== Completed! Stored {len(docs)} document chunks in collection '{collection_name}' ===")
-    
+            for point_id, doc in zip(ids, batch_docs)
+        ]
+
+        point_queue.put((ids, embeddings, payloads))
+        total_docs += len(batch_docs)
+
+    point_queue.put(_DONE)
+    producer.join()
+    uploader.join()
+
+    if not total_docs:
+        log.error("No documents loaded. Exiting.")
+        return False
+
+    log.info("=== Completed! Stored %d document chunks in collection '%s' ===", total_docs, collection_name)
+
     # Verify storage
     try:
         collection_info = client.get_collection(collection_name)
-        print(f"Collection info: {collection_info.points_count} points stored")
+        log.info("Collection info: %d points stored", collection_info.points_count)
     except Exception as e:
-        print(f"Error getting collection info: {e}")
-    
+        log.error("Error getting collection info: %s", e)
+
     return True
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    
     # You can specify custom PDF directory if needed
     pdf_dir = sys.argv[1] if len(sys.argv) > 1 else "pdfs"
     success = store_pdf_embeddings(pdf_dir)
-    
+
     if success:
         print("✅ PDF embedding process completed successfully!")
     else:
-        print("❌ PDF embedding process failed!")
\ No newline at end of file
+        print("❌ PDF embedding process failed!")